@@ -1,41 +1,148 @@
 #!/usr/bin/env python3
 """
 Интерактивный парсер глав с teletype.in и сборка EPUB.
-Версия на requests + BeautifulSoup (без Selenium).
+Версия на requests + lxml (без Selenium).
 """
 
 import os
 import re
 import sys
-import json
 import time
 import random
 import hashlib
+import io
+import functools
+import mmap
 import base64
+import struct
+import json
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import traceback
 import textwrap
+from urllib.parse import urlsplit
+import zipfile
+import threading
 
-from typing import List, Dict, Tuple, Optional, Set
-from bs4 import BeautifulSoup
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from collections import OrderedDict, deque
+from typing import Callable, Iterable, Iterator, List, Dict, Tuple, Optional, Set
+import lxml.html
+from lxml import etree
 
 from ebooklib import epub
 from PIL import Image
 from io import BytesIO
 
+# orjson необязателен: с ним кэш и JSON страниц разбираются в разы быстрее,
+# без него работает stdlib json. orjson.JSONDecodeError — подкласс json.JSONDecodeError.
+try:
+    import orjson
+
+    json_loads = orjson.loads
+    json_dumps = orjson.dumps
+except ImportError:
+    json_loads = json.loads
+
+    def json_dumps(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
 
 # ─── Константы ───────────────────────────────────────────────────────────────
 
 DEFAULT_LINKS_FILES = ["example.txt", "links.txt"]
 CACHE_DIR = "cache"
 IMAGES_DIR = "images"
-DEFAULT_DELAY_MIN = 1
-DEFAULT_DELAY_MAX = 3
+# Пауза между запросами к одному редактору (@username), сек.
+DEFAULT_DELAY_MIN = 0.5
+DEFAULT_DELAY_MAX = 1.5
+# Сколько глав качаем одновременно
+FETCH_WORKERS = 8
+FETCH_RETRIES = 3
+# Пауза перед повтором: 0.5 с, затем 1 с, ... (удваивается)
+RETRY_BACKOFF = 0.5
+# Общий пул для картинок всех глав
+IMAGE_WORKERS = 16
+IMAGE_RETRIES = 2
+# Картинки больше этого размера не скачиваем до конца
+MAX_IMAGE_BYTES = 10_000_000
+IMAGE_CHUNK_SIZE = 64 * 1024
+# Сколько байт готовых картинок помнить между главами (повторяющиеся заставки, разделители)
+IMAGE_MEMO_BYTES = 64 * 1024 * 1024
+# Не больше стольких одновременных запросов к одному хосту (как у браузеров)
+MAX_CONNECTIONS_PER_HOST = 6
+# Пережатие картинок перед упаковкой в EPUB
+IMAGE_MAX_SIZE = (1600, 1600)
+JPEG_QUALITY = 85
+WEBP_QUALITY = 80
+# Форматы пережатия картинок: формат Pillow и расширение файла
+RECOMPRESS_FORMATS = {"jpeg": ("JPEG", "jpg"), "webp": ("WEBP", "webp")}
+IMAGE_MEDIA_TYPES = {"jpg": "image/jpeg", "png": "image/png", "webp": "image/webp", "gif": "image/gif"}
+# Уровень DEFLATE для XHTML/CSS в EPUB (картинки пишутся без сжатия)
+EPUB_COMPRESSLEVEL = 6
 
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
 }
 
+def make_session(workers: int, max_retries: Retry | int = 0) -> requests.Session:
+    """Сессия с keep-alive: TCP+TLS поднимается один раз на хост, а не на каждый запрос"""
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    # Одновременных запросов к хосту не больше min(потоки, HOST_LIMITER) —
+    # ровно столько соединений держим в пуле, чтобы urllib3 не выбрасывал лишние
+    adapter = HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=min(workers, MAX_CONNECTIONS_PER_HOST),
+        max_retries=max_retries,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+# Страницы глав: повторы делает fetch_and_cache (с учетом RateLimiter)
+SESSION = make_session(FETCH_WORKERS)
+# Картинки (CDN): повторы на уровне urllib3, чтобы один сбой не терял картинку
+IMAGE_SESSION = make_session(IMAGE_WORKERS, Retry(
+    total=IMAGE_RETRIES,
+    backoff_factor=0.3,
+    status_forcelist=(429, 500, 502, 503, 504),
+))
+
+IMAGE_EXECUTOR = ThreadPoolExecutor(max_workers=IMAGE_WORKERS)
+
+
+def close_network():
+    """Останавливает пул картинок и закрывает пулы соединений обеих сессий"""
+    IMAGE_EXECUTOR.shutdown(wait=False, cancel_futures=True)
+    SESSION.close()
+    IMAGE_SESSION.close()
+
+# Ссылки вида "Глава 123 (https://teletype.in/@username/slug...)" ищем в два шага:
+# сначала поиск маркера ссылки, затем узкие регулярки вокруг найденного места.
+# Ссылки, как и раньше, регистронезависимы (HTTPS://TELETYPE.IN/@...).
+_RE_LINK_MARKER = re.compile(r"teletype\.in/@", re.IGNORECASE)
+# Группа 1: никнейм автора ссылки (включая @)
+_RE_TELETYPE_URL = re.compile(r"https?://teletype\.in/(@[\w-]+)/[^\s)?]+", re.IGNORECASE)
+# Группа 1: номер главы. Регистр свернут в классы символов вместо re.IGNORECASE
+_RE_CHAPTER_NUM = re.compile(r"[Гг][Лл][Аа][Вв][Аа]\s+(\d+)")
+
+# JSON состояния страницы: window.__INITIAL_STATE__={...} до ";window." (обычно
+# ...};window.__PUBLIC_PATH__) или до конца <script>. Ищем в байтах, без декодирования страницы.
+_RE_INITIAL_STATE = re.compile(rb"window\.__INITIAL_STATE__=(.*?)(?:;window\.|</script>)", re.DOTALL)
+
+# Контейнер статьи в HTML-версии страницы (fetch_chapter_fallback)
+_HAS_CONTENT_CLASS = 'contains(concat(" ", normalize-space(@class), " "), " article__content ")'
+_XPATH_ARTICLE = etree.XPath(f"//article[{_HAS_CONTENT_CLASS}]")
+_XPATH_ARTICLE_DIV = etree.XPath(f"//div[{_HAS_CONTENT_CLASS}]")
+
+# Мусор teletype, вычищаемый clean_block прямо в дереве lxml
+# (комментарии выбрасывает еще парсер, см. html_parser):
+# пустые якоря <a name="..."></a> и атрибуты data-*
+_XPATH_EMPTY_ANCHORS = etree.XPath(".//a[@name and count(@*) = 1 and not(*) and not(normalize-space())]")
+_RE_WS = re.compile(r"\s{2,}")
+
 CSS_CONTENT = """
 body {
     font-family: serif;
@@ -79,6 +186,8 @@ class Config:
         self.start_chapter: int = 0
         self.end_chapter: int = 0
         self.include_images: bool = True
+        self.recompress_images: bool = True
+        self.image_format: str = "jpeg"  # ключ RECOMPRESS_FORMATS
         self.editor_priority: List[str] = []
         self.output_filename: str = ""
         
@@ -86,96 +195,215 @@ class Config:
     def book_language(self) -> str:
         return "ru"
 
+    @property
+    def recompress_format(self) -> Optional[str]:
+        """Во что пережимать картинки; None — оставлять как скачали"""
+        return self.image_format if self.recompress_images else None
+
+
+class RateLimiter:
+    """
+    Ограничивает частоту запросов отдельно для каждого ключа (редактора).
+    Потоки резервируют себе слоты по очереди, так что под конкуренцией
+    к одному редактору по-прежнему уходит ~1 запрос в секунду.
+    """
+
+    def __init__(self, delay_min: float, delay_max: float):
+        self.delay_min = delay_min
+        self.delay_max = delay_max
+        self._lock = threading.Lock()
+        self._next_slot: Dict[str, float] = {}
+
+    def wait(self, key: str):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(key, now))
+            self._next_slot[key] = slot + random.uniform(self.delay_min, self.delay_max)
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class HostLimiter:
+    """
+    Ограничивает число одновременных запросов к одному хосту.
+    Потоки глав и картинок делят общий пул, и без этого все они
+    могут одновременно навалиться на один CDN.
+    """
+
+    def __init__(self, max_per_host: int):
+        self.max_per_host = max_per_host
+        self._lock = threading.Lock()
+        self._semaphores: Dict[str, threading.Semaphore] = {}
+
+    def slot(self, url: str) -> threading.Semaphore:
+        """Семафор хоста из url; использовать как `with HOST_LIMITER.slot(url): ...`"""
+        host = urlsplit(url).netloc
+        with self._lock:
+            sem = self._semaphores.get(host)
+            if sem is None:
+                sem = self._semaphores[host] = threading.Semaphore(self.max_per_host)
+        return sem
+
+
+HOST_LIMITER = HostLimiter(MAX_CONNECTIONS_PER_HOST)
+
+
+class ImageMemo:
+    """
+    Общая для всех глав память скачанных картинок по URL.
+    Повторный URL не качается заново, а если его уже качает другой поток,
+    ждем тот же результат. Объем ограничен max_bytes: самые давно
+    использованные картинки вытесняются первыми.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._items: OrderedDict[str, Future] = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._total = 0
+
+    def get_or_fetch(self, url: str, fetch: Callable[[], Optional[Tuple[str, bytes]]]) -> Optional[Tuple[str, bytes]]:
+        with self._lock:
+            future = self._items.get(url)
+            owner = future is None
+            if owner:
+                future = self._items[url] = Future()
+            else:
+                self._items.move_to_end(url)
+        if not owner:
+            return future.result()
+
+        try:
+            result = fetch()
+        except BaseException as e:
+            with self._lock:
+                self._items.pop(url, None)
+            future.set_exception(e)
+            raise
+        future.set_result(result)
+
+        with self._lock:
+            if result is None:
+                # Неудачу не запоминаем: в следующей главе попробуем еще раз
+                self._items.pop(url, None)
+            elif url in self._items:
+                size = len(result[1])
+                self._sizes[url] = size
+                self._total += size
+                self._evict()
+        return result
+
+    def clear(self):
+        """Забывает все скачанные картинки; незавершенные загрузки не трогаем"""
+        with self._lock:
+            for url in [url for url, future in self._items.items() if future.done()]:
+                del self._items[url]
+                self._total -= self._sizes.pop(url, 0)
+
+    def _evict(self):
+        while self._total > self.max_bytes and self._items:
+            url, future = next(iter(self._items.items()))
+            if not future.done():
+                break
+            del self._items[url]
+            self._total -= self._sizes.pop(url, 0)
+
+
+IMAGE_MEMO = ImageMemo(IMAGE_MEMO_BYTES)
+
 
 # ─── Парсинг ссылок ──────────────────────────────────────────────────────────
 
-def parse_links_file(filepath: str) -> Tuple[Dict[int, Dict[str, str]], List[str]]:
+def parse_links_file(filepath: str) -> Tuple[Dict[int, Dict[str, str]], List[str], Dict[str, int]]:
     """
     Парсит файл со ссылками.
     
     Возвращает:
         chapters: dict[номер_главы, dict[редактор, url]]
         all_editors: список всех найденных редакторов (никнеймов teletype)
+        editor_counts: dict[редактор, сколько глав у него есть]
     """
     
     # Структура: { 310: { '@cult': 'url...', '@grape': 'url...' } }
     chapters: Dict[int, Dict[str, str]] = {}
-    editors_set: Set[str] = set()
+    editor_counts: Dict[str, int] = {}
 
+    # Читаем построчно: ссылка и ее "Глава N" всегда на одной строке,
+    # а весь файл (у краулеров бывают тысячи глав) в память не грузится
     with open(filepath, "r", encoding="utf-8") as f:
-        text = f.read()
-
-    # Регулярка ищет: "Глава 123 (https://teletype.in/@username/slug...)"
-    # Группа 1: номер главы
-    # Группа 2: ссылка целиком
-    # Группа 3: никнейм автора ссыки (включая @)
-    pattern = re.compile(
-        r"[Гг]лава\s+(\d+).*?\(?(https?://teletype\.in/(@[\w\-_]+)/[^\s\)\n\?]+)", 
-        re.MULTILINE | re.IGNORECASE
-    )
+        for line in f:
+            for num, editor, url in iter_line_links(line):
+                if num not in chapters:
+                    chapters[num] = {}
+                
+                if editor not in chapters[num]:
+                    editor_counts[editor] = editor_counts.get(editor, 0) + 1
+                chapters[num][editor] = url
 
-    for m in pattern.finditer(text):
-        num = int(m.group(1))
-        url = m.group(2).strip().rstrip(")")
-        editor = m.group(3)
+    return chapters, sorted(editor_counts), editor_counts
 
-        if num not in chapters:
-            chapters[num] = {}
-        
-        chapters[num][editor] = url
-        editors_set.add(editor)
 
-    return chapters, sorted(list(editors_set))
+def iter_line_links(line: str) -> Iterator[Tuple[int, str, str]]:
+    """Находит в строке пары "Глава N ... ссылка" и отдает (номер, редактор, url)"""
+    pos = 0
+    prev_end = 0  # конец предыдущей принятой ссылки: ее "Глава N" не переиспользуем
+    while True:
+        marker_m = _RE_LINK_MARKER.search(line, pos)
+        if not marker_m:
+            return
+        idx = marker_m.start()
+        pos = marker_m.end()
+
+        # Схема перед маркером: "https://" (8 символов) или "http://" (7)
+        url_m = None
+        for url_start in (idx - 8, idx - 7):
+            if url_start >= 0:
+                url_m = _RE_TELETYPE_URL.match(line, url_start)
+                if url_m:
+                    break
+        if not url_m:
+            continue
+
+        # "Глава N" ищем только левее ссылки
+        num_m = _RE_CHAPTER_NUM.search(line, prev_end, url_start)
+        if not num_m:
+            continue
+        pos = prev_end = url_m.end()
+
+        yield int(num_m.group(1)), url_m.group(1), url_m.group(0).strip()
 
 
-# ─── Парсинг одной главы (Requests + BS4) ────────────────────────────────────
+# ─── Парсинг одной главы (Requests + lxml) ───────────────────────────────────
 
-def fetch_chapter(url: str, include_images: bool) -> dict:
+def fetch_chapter(url: str, include_images: bool, image_format: Optional[str] = None) -> dict:
     """Возвращает {'title': str, 'html': str, 'images': [(url, bytes), ...]}"""
 
-    resp = requests.get(url, headers=HEADERS, timeout=30)
+    with HOST_LIMITER.slot(url):
+        resp = SESSION.get(url, timeout=30)
     resp.raise_for_status()
-    # Принудительно ставим UTF-8, так как Teletype может не отдавать charset в заголовках,
-    # и requests по умолчанию выберет ISO-8859-1, что сломает кириллицу.
-    resp.encoding = 'utf-8'
+    # Работаем с байтами: страницу целиком в str не декодируем.
+    # Кодировку (UTF-8) задает html_parser() — Teletype может не отдавать charset в заголовках.
+    raw = resp.content
     
     # ── Извлечение JSON-данных (Hydration) ──
     # Teletype отдает контент внутри window.__INITIAL_STATE__
-    text_data = resp.text
-    
-    start_marker = "window.__INITIAL_STATE__="
-    
-    start_idx = text_data.find(start_marker)
-    if start_idx == -1:
+    m = _RE_INITIAL_STATE.search(raw)
+    if not m:
         # Fallback на случай, если структура изменится или это статический рендер
-        return fetch_chapter_fallback(resp.text, include_images)
-        
-    start_idx += len(start_marker)
-    # Ищем конец JSON. Обычно это ";window." или "</script>"
-    # Чаще всего: ...};window.__PUBLIC_PATH__
-    
-    # Попробуем найти ближайший ";window."
-    end_idx = text_data.find(";window.", start_idx)
-    if end_idx == -1:
-        # Попробуем </script>
-        end_idx = text_data.find("</script>", start_idx)
-    
-    if end_idx == -1:
-         return fetch_chapter_fallback(resp.text, include_images)
-         
-    json_str = text_data[start_idx:end_idx]
+        return fetch_chapter_fallback(raw, include_images, image_format)
     
     try:
-        data = json.loads(json_str)
-    except json.JSONDecodeError:
+        data = json_loads(m.group(1))
+    except ValueError:  # JSONDecodeError у обоих бэкендов, UnicodeDecodeError у stdlib json
         print("   ⚠ Ошибка парсинга JSON state, пробуем fallback...")
-        return fetch_chapter_fallback(resp.text, include_images)
+        return fetch_chapter_fallback(raw, include_images, image_format)
     
     # Ищем статью
     # data['articles']['items'] - словарь, где ключи это ID
     articles_map = data.get("articles", {}).get("items", {})
     if not articles_map:
-        return fetch_chapter_fallback(resp.text, include_images)
+        return fetch_chapter_fallback(raw, include_images, image_format)
     
     # Берем первую статью (обычно она одна на странице)
     article_item = next(iter(articles_map.values()))
@@ -183,35 +411,32 @@ def fetch_chapter(url: str, include_images: bool) -> dict:
     title = article_item.get("title", "")
     raw_html_content = article_item.get("text", "") # Это строка с HTML
     
-    if not raw_html_content:
+    if not raw_html_content or not raw_html_content.strip():
         return {"title": title, "html": "<p>(Пусто)</p>", "images": []}
 
     # Парсим HTML контент из JSON
-    soup = BeautifulSoup(raw_html_content, 'lxml')
+    tree = lxml.html.document_fromstring(raw_html_content, parser=html_parser())
     
+    # Блоки пишутся в buf; на месте картинки buf сбрасывается в content_parts
+    # и туда же добавляется пустой слот, который потом заполнит fill_image_slots
+    buf = io.StringIO()
     content_parts: list[str] = []
-    images: list[tuple[str, bytes]] = []
+    image_slots: list[tuple[int, str]] = []  # (индекс в content_parts, url)
 
-    # Корневой элемент там часто <document>, перебираем его детей
-    # Если <document> нет, BS распарсит как html/body/p и т.д.
-    # Проще просто перебрать все элементы верхнего уровня (исключая html/body если BS их добавил)
-    
-    # BS добавляет <html><body> если их нет.
-    # Если исходник был <document>..., то он будет внутри body
+    # Корневой элемент там часто <document>, перебираем его детей.
+    # lxml всегда достраивает <html><body>, так что <document> (если есть) будет внутри body
+    body = tree.find("body")
+    root = body if body is not None else tree
     
-    body = soup.find("body")
-    root = body if body else soup
-    
-    # Иногда <document> внутри body
-    doc_tag = root.find("document")
-    if doc_tag:
+    doc_tag = root.find(".//document")
+    if doc_tag is not None:
         root = doc_tag
 
-    for child in root.children:
-        if child.name is None:
-            continue
+    for child in root.iterchildren():
+        if not isinstance(child.tag, str):
+            continue  # комментарии и processing instructions
             
-        tag = child.name.lower()
+        tag = child.tag.lower()
 
         if tag == "image": 
             # В JSON-HTML teletype часто использует тег <image src="..."> вместо <img> или <figure>
@@ -221,118 +446,266 @@ def fetch_chapter(url: str, include_images: bool) -> dict:
 
             img_src = child.get("src")
             if img_src:
-                img_data = download_image(img_src)
-                if img_data:
-                    img_hash = hashlib.md5(img_src.encode()).hexdigest()
-                    ext = "jpg" if "jpeg" in img_src or "jpg" in img_src else "png"
-                    img_filename = f"img_{img_hash}.{ext}"
-                    images.append((img_filename, img_data))
-                    content_parts.append(
-                        f'<p style="text-align:center;">'
-                        f'<img src="images/{img_filename}" alt="" />'
-                        f"</p>"
-                    )
+                # Место под картинку; сами картинки качаем пачкой после обхода
+                content_parts.append(buf.getvalue())
+                buf = io.StringIO()
+                image_slots.append((len(content_parts), img_src))
+                content_parts.append("")
             continue
             
         # Обычные теги
         if tag in ("p", "h1", "h2", "h3", "h4", "h5", "h6", "blockquote", "ul", "ol", "div"):
-            inner = child.decode_contents()
-            inner = clean_html(inner)
+            inner = clean_block(child)
             
             if inner.strip():
                 # Центрирование
                 align = child.get("align", "") # В JSON версии attribute align часто прямо в теге
-                style = ' style="text-align:center;"' if align == "center" else ""
-                content_parts.append(f"<{tag}{style}>{inner}</{tag}>")
+                write_block(buf, tag, inner, align == "center")
 
-    html = "\n".join(content_parts)
+    content_parts.append(buf.getvalue())
+    images = fill_image_slots(content_parts, image_slots, image_format)
+    html = "".join(content_parts).rstrip("\n")
     return {"title": title, "html": html, "images": images}
 
 
-def fetch_chapter_fallback(html_source: str, include_images: bool) -> dict:
-    """Старый метод парсинга через BS, если JSON не нашли (или если это сохраненная страница)"""
-    soup = BeautifulSoup(html_source, 'lxml')
+def fetch_chapter_fallback(html_source: bytes | str, include_images: bool, image_format: Optional[str] = None) -> dict:
+    """Старый метод парсинга через lxml, если JSON не нашли (или если это сохраненная страница)"""
+    tree = lxml.html.fromstring(html_source, parser=html_parser())
 
     # ── Заголовок ──
-    title_el = soup.select_one("h1.article__header_title")
-    title = title_el.get_text(strip=True) if title_el else ""
+    title_texts = tree.xpath('//h1[contains(@class, "article__header_title")]//text()')
+    title = "".join(title_texts).strip()
 
     # ── Контент ──
-    article = soup.select_one("article.article__content")
-    if not article:
-        article = soup.select_one("div.article__content")
-    
-    if not article:
+    # Сначала <article>, и только если его нет — <div>; класс сравниваем целым токеном
+    articles = _XPATH_ARTICLE(tree) or _XPATH_ARTICLE_DIV(tree)
+    if not articles:
          return {"title": title, "html": "<p>Не удалось найти контент (ни JSON, ни HTML)</p>", "images": []}
+    article = articles[0]
 
+    # Блоки пишутся в buf; на месте картинки buf сбрасывается в content_parts
+    # и туда же добавляется пустой слот, который потом заполнит fill_image_slots
+    buf = io.StringIO()
     content_parts: list[str] = []
-    images: list[tuple[str, bytes]] = []
+    image_slots: list[tuple[int, str]] = []  # (индекс в content_parts, url)
 
-    for child in article.children:
-        if child.name is None:
-            continue
+    for child in article.iterchildren():
+        if not isinstance(child.tag, str):
+            continue  # комментарии и processing instructions
         
-        tag = child.name.lower()
+        tag = child.tag.lower()
 
         if tag == "figure":
             if not include_images:
                 continue 
             
+            # lxml разбирает содержимое <noscript> как обычные элементы
             img_src = None
-            noscript = child.select_one("noscript")
-            if noscript:
-                ns_soup = BeautifulSoup(noscript.decode_contents(), "lxml")
-                img_el = ns_soup.find("img")
-                if img_el and img_el.get("src"):
-                    img_src = img_el.get("src")
+            ns_img = child.find(".//noscript//img")
+            if ns_img is not None and ns_img.get("src"):
+                img_src = ns_img.get("src")
             
             if not img_src:
-                img_el = child.find("img")
-                if img_el:
+                img_el = child.find(".//img")
+                if img_el is not None:
                      img_src = img_el.get("src") or img_el.get("data-src")
 
             if img_src:
-                img_data = download_image(img_src)
-                if img_data:
-                    img_hash = hashlib.md5(img_src.encode()).hexdigest()
-                    ext = "jpg" if "jpeg" in img_src or "jpg" in img_src else "png"
-                    img_filename = f"img_{img_hash}.{ext}"
-                    images.append((img_filename, img_data))
-                    content_parts.append(
-                        f'<p style="text-align:center;">'
-                        f'<img src="images/{img_filename}" alt="" />'
-                        f"</p>"
-                    )
+                content_parts.append(buf.getvalue())
+                buf = io.StringIO()
+                image_slots.append((len(content_parts), img_src))
+                content_parts.append("")
             continue
 
         if tag in ("p", "h1", "h2", "h3", "h4", "h5", "h6", "blockquote", "ul", "ol", "div"):
-            inner = child.decode_contents()
-            inner = clean_html(inner)
+            inner = clean_block(child)
             
             if inner.strip():
                 align = child.get("data-align", "")
-                style = ' style="text-align:center;"' if align == "center" else ""
-                content_parts.append(f"<{tag}{style}>{inner}</{tag}>")
+                write_block(buf, tag, inner, align == "center")
 
-    html = "\n".join(content_parts)
+    content_parts.append(buf.getvalue())
+    images = fill_image_slots(content_parts, image_slots, image_format)
+    html = "".join(content_parts).rstrip("\n")
     return {"title": title, "html": html, "images": images}
 
 
+_parser_local = threading.local()
+
+def html_parser() -> lxml.html.HTMLParser:
+    """
+    HTML-парсер lxml, один на поток (сам парсер между потоками не делится).
+    Комментарии и processing instructions выбрасываются еще при разборе,
+    так что для них не создаются узлы дерева.
+    Байты всегда читаются как UTF-8: без этого libxml2 при отсутствии
+    <meta charset> выберет ISO-8859-1 и сломает кириллицу.
+    """
+    parser = getattr(_parser_local, "parser", None)
+    if parser is None:
+        parser = _parser_local.parser = lxml.html.HTMLParser(
+            remove_comments=True, remove_pis=True, encoding="utf-8"
+        )
+    return parser
+
+
+def inner_html(el) -> str:
+    """
+    innerHTML элемента lxml. Сериализуем элемент один раз целиком и отрезаем
+    внешний тег, вместо отдельного вызова tostring на каждого ребенка.
+    Внутри значений атрибутов lxml экранирует '>', так что первый '>' — конец открывающего тега.
+    """
+    outer = etree.tostring(el, encoding="unicode", method="html", with_tail=False)
+    start = outer.find(">") + 1
+    end = outer.rfind("</")
+    return outer[start:end] if end >= start else ""
+
+
+
+def clean_block(el) -> str:
+    """
+    Очищает блок от мусора teletype и возвращает его innerHTML.
+    Чистим само дерево (C-код lxml), а не регулярками сериализованную строку;
+    остается только схлопнуть пробелы.
+    """
+    for anchor in _XPATH_EMPTY_ANCHORS(el):
+        anchor.drop_tree()  # хвостовой текст якоря сохраняется
+    for node in el.iterdescendants():
+        data_attrs = [name for name in node.attrib if name.startswith("data-")]
+        for name in data_attrs:
+            del node.attrib[name]
+    return _RE_WS.sub(" ", inner_html(el)).strip()
+
+
+def write_block(buf: io.StringIO, tag: str, inner: str, centered: bool) -> None:
+    """Пишет блок <tag>inner</tag> в буфер главы, без промежуточной f-строки"""
+    buf.write("<")
+    buf.write(tag)
+    if centered:
+        buf.write(' style="text-align:center;"')
+    buf.write(">")
+    buf.write(inner)
+    buf.write("</")
+    buf.write(tag)
+    buf.write(">\n")
+
+
+def fill_image_slots(content_parts: list[str], image_slots: list[tuple[int, str]],
+                     image_format: Optional[str] = None) -> list[tuple[str, bytes]]:
+    """Параллельно скачивает картинки и вставляет <img> на зарезервированные места"""
+    images: list[tuple[str, bytes]] = []
+    srcs = [src for _, src in image_slots]
+    results = IMAGE_EXECUTOR.map(fetch_image, srcs, [image_format] * len(srcs))
+    for (pos, _), result in zip(image_slots, results):
+        if result is None:
+            continue
+        img_filename, img_data = result
+        images.append((img_filename, img_data))
+        content_parts[pos] = (
+            f'<p style="text-align:center;">'
+            f'<img src="images/{img_filename}" alt="" />'
+            f"</p>\n"
+        )
+    return images
+
+
+def fetch_image(img_src: str, image_format: Optional[str] = None) -> tuple[str, bytes] | None:
+    """Картинка с именем файла; повторные URL берутся из IMAGE_MEMO. Выполняется в IMAGE_EXECUTOR."""
+    return IMAGE_MEMO.get_or_fetch(
+        f"{image_format}:{img_src}",
+        lambda: download_and_name_image(img_src, image_format)
+    )
+
+
+def download_and_name_image(img_src: str, image_format: Optional[str] = None) -> tuple[str, bytes] | None:
+    """Скачивает картинку, при необходимости пережимает в image_format и придумывает ей имя файла"""
+    img_data = download_image(img_src)
+    if not img_data:
+        return None
+    img_hash = image_id(img_src)
+    if image_format:
+        recompressed = recompress_image(img_data, image_format)
+        if recompressed is not None:
+            return f"img_{img_hash}.{RECOMPRESS_FORMATS[image_format][1]}", recompressed
+    ext, _ = sniff_image_type(img_data)
+    return f"img_{img_hash}.{ext}", img_data
+
+
+@functools.lru_cache(maxsize=4096)
+def image_id(url: str) -> str:
+    """Короткий id картинки для имени файла: BLAKE2b-64 от URL в base32 (13 символов)"""
+    digest = hashlib.blake2b(url.encode(), digest_size=8).digest()
+    return base64.b32encode(digest).rstrip(b"=").lower().decode("ascii")
+
+
+def sniff_image_type(img_data: bytes) -> tuple[str, str]:
+    """(расширение, media type) по сигнатуре файла; по URL тип не угадать (query-строки, CDN без расширений)"""
+    head = img_data[:12]
+    if head[:3] == b"\xff\xd8\xff":
+        ext = "jpg"
+    elif head[:8] == b"\x89PNG\r\n\x1a\n":
+        ext = "png"
+    elif head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        ext = "webp"
+    elif head[:4] == b"GIF8":
+        ext = "gif"
+    else:
+        ext = "jpg"
+    return ext, IMAGE_MEDIA_TYPES[ext]
+
 
-def clean_html(html: str) -> str:
-    # Очистка от мусора teletype
-    html = re.sub(r'<a\s+name="[^"]*"\s*>\s*</a\s*>', "", html)
-    html = re.sub(r"<!--.*?-->", "", html, flags=re.DOTALL)
-    html = re.sub(r'\s+data-[\w-]+="[^"]*"', "", html)
-    html = re.sub(r"\s{2,}", " ", html).strip()
-    return html
+def recompress_image(img_data: bytes, image_format: str = "jpeg") -> bytes | None:
+    """
+    Уменьшает картинку до IMAGE_MAX_SIZE и пережимает в JPEG или WebP (см. RECOMPRESS_FORMATS).
+    Возвращает None, если картинку лучше оставить как есть
+    (не открылась, анимированная или результат вышел не меньше оригинала).
+    """
+    try:
+        with Image.open(BytesIO(img_data)) as im:
+            if getattr(im, "is_animated", False):
+                return None
+            im.thumbnail(IMAGE_MAX_SIZE, Image.LANCZOS)
+            out = BytesIO()
+            if image_format == "webp":
+                # WebP умеет прозрачность, фон не нужен
+                if im.mode not in ("RGB", "RGBA"):
+                    im = im.convert("RGBA" if im.mode in ("LA", "P", "PA") else "RGB")
+                im.save(out, "WEBP", quality=WEBP_QUALITY, method=4)
+                return _smaller(out.getvalue(), img_data)
+            if im.mode in ("RGBA", "LA", "P"):
+                # Прозрачность в JPEG не поддерживается — кладем на белый фон
+                im = im.convert("RGBA")
+                bg = Image.new("RGB", im.size, (255, 255, 255))
+                bg.paste(im, mask=im.getchannel("A"))
+                im = bg
+            elif im.mode not in ("RGB", "L"):
+                im = im.convert("RGB")
+            im.save(out, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+            return _smaller(out.getvalue(), img_data)
+    except Exception as e:
+        print(f"  ⚠ Image recompress fail: {e}")
+        return None
+
+
+def _smaller(data: bytes, original: bytes) -> bytes | None:
+    return data if len(data) < len(original) else None
 
 
 def download_image(url: str) -> bytes | None:
+    """Скачивает картинку потоком; слишком большие (> MAX_IMAGE_BYTES) бросаем, не дочитывая"""
     try:
-        resp = requests.get(url, headers=HEADERS, timeout=30)
-        resp.raise_for_status()
-        return resp.content
+        with HOST_LIMITER.slot(url), IMAGE_SESSION.get(url, stream=True, timeout=30) as resp:
+            resp.raise_for_status()
+            length = resp.headers.get("Content-Length")
+            if length and length.isdigit() and int(length) > MAX_IMAGE_BYTES:
+                print(f"  ⚠ Image too large ({int(length)} bytes), skipped: {url}")
+                return None
+            buf = bytearray()
+            for chunk in resp.iter_content(chunk_size=IMAGE_CHUNK_SIZE):
+                buf += chunk
+                if len(buf) > MAX_IMAGE_BYTES:
+                    print(f"  ⚠ Image too large (> {MAX_IMAGE_BYTES} bytes), skipped: {url}")
+                    return None
+            return bytes(buf)
     except Exception as e:
         print(f"  ⚠ Image fail: {e}")
         return None
@@ -343,52 +716,162 @@ def download_image(url: str) -> bytes | None:
 def get_cache_filename(chapter_num: int, cache_dir: str) -> str:
     return os.path.join(cache_dir, f"chapter_{chapter_num}.json")
 
+def get_cache_blob_filename(chapter_num: int, cache_dir: str) -> str:
+    return os.path.join(cache_dir, f"chapter_{chapter_num}.bin")
+
+# Формат .bin: подряд идущие кадры [4 байта длины (big-endian)][байты картинки],
+# в том же порядке, что и имена файлов в .json
+_FRAME_HEADER = struct.Struct(">I")
+
+def _write_atomic(path: str, chunks: Iterable[bytes]):
+    """Пишет во временный файл и подменяет им path: прерванная запись не оставит полфайла"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        for chunk in chunks:
+            f.write(chunk)
+    os.replace(tmp_path, path)
+
 def save_cache(chapter_data: dict, cache_dir: str):
     os.makedirs(cache_dir, exist_ok=True)
-    path = get_cache_filename(chapter_data["chapter_num"], cache_dir)
+    num = chapter_data["chapter_num"]
+    images = chapter_data.get("images", [])
     
-    # Сериализация для JSON
+    # Байты картинок — в бинарный файл рядом, без base64
+    if images:
+        _write_atomic(get_cache_blob_filename(num, cache_dir), (
+            chunk
+            for _, data in images
+            for chunk in (_FRAME_HEADER.pack(len(data)), data)
+        ))
+    
+    # JSON пишем последним: его наличие означает, что запись в кэше целая
     to_save = {
-        "chapter_num": chapter_data["chapter_num"],
+        "chapter_num": num,
         "title": chapter_data["title"],
         "html": chapter_data["html"],
-        "images": [
-            {"filename": fname, "data_b64": base64.b64encode(data).decode('ascii')}
-            for fname, data in chapter_data.get("images", [])
-        ],
-        "has_images": bool(chapter_data.get("images"))
+        "images": [fname for fname, _ in images],
+        "has_images": bool(images)
     }
     
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(to_save, f, ensure_ascii=False)
+    _write_atomic(get_cache_filename(num, cache_dir), [json_dumps(to_save)])
+
+def scan_cache(cache_dir: str) -> Set[int]:
+    """Номера закэшированных глав — одним листингом папки вместо stat на каждую главу"""
+    nums: Set[int] = set()
+    try:
+        entries = os.scandir(cache_dir)
+    except FileNotFoundError:
+        return nums
+    with entries:
+        for entry in entries:
+            name = entry.name
+            if name.startswith("chapter_") and name.endswith(".json"):
+                num = name[len("chapter_"):-len(".json")]
+                if num.isdigit():
+                    nums.add(int(num))
+    return nums
 
 def load_cache(chapter_num: int, cache_dir: str) -> dict | None:
     path = get_cache_filename(chapter_num, cache_dir)
-    if not os.path.exists(path):
-        return None
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            
-        # Восстановление байтов картинок
-        data["images"] = [
-            (img["filename"], base64.b64decode(img["data_b64"]))
-            for img in data.get("images", [])
-        ]
+        with open(path, "rb") as f:
+            data = json_loads(f.read())
+        
+        filenames = data.get("images", [])
+        if not all(isinstance(fname, str) for fname in filenames):
+            return _migrate_legacy_cache(data, cache_dir)
+        
+        data["images"] = []
+        if filenames:
+            with open(get_cache_blob_filename(chapter_num, cache_dir), "rb") as f, \
+                    mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as blob:
+                offset = 0
+                for fname in filenames:
+                    (size,) = _FRAME_HEADER.unpack_from(blob, offset)
+                    offset += _FRAME_HEADER.size
+                    if offset + size > len(blob):
+                        return None
+                    data["images"].append((fname, blob[offset:offset + size]))
+                    offset += size
         return data
     except Exception:
         return None
 
 
+def _migrate_legacy_cache(data: dict, cache_dir: str) -> dict:
+    """Старый формат кэша: картинки в base64 внутри JSON. Переписываем запись в новый формат."""
+    data["images"] = [
+        (img["filename"], base64.b64decode(img["data_b64"]))
+        for img in data.get("images", [])
+    ]
+    save_cache(data, cache_dir)
+    return data
+
+
+def iter_cache(chapter_nums: List[int], cache_dir: str, prefetch: int = 4) -> Iterator[Tuple[int, dict | None]]:
+    """
+    Читает главы из кэша по порядку. Чтение идет в фоне, но наперед
+    загружено не больше prefetch глав, чтобы не держать в памяти всю книгу.
+    """
+    with ThreadPoolExecutor(max_workers=prefetch) as executor:
+        pending = deque()
+        for num in chapter_nums:
+            pending.append((num, executor.submit(load_cache, num, cache_dir)))
+            if len(pending) > prefetch:
+                done_num, future = pending.popleft()
+                yield done_num, future.result()
+        while pending:
+            done_num, future = pending.popleft()
+            yield done_num, future.result()
+
+
 # ─── Сборка EPUB ─────────────────────────────────────────────────────────────
 
-def build_epub_file(chapters_data: list[dict], config: Config):
+class EpubWriter(epub.EpubWriter):
+    """
+    EpubWriter из ebooklib, который кладет картинки в архив без сжатия (ZIP_STORED).
+    JPEG/PNG и так сжаты, DEFLATE на них только тратит CPU; XHTML/CSS по-прежнему сжимаются.
+    """
+
+    def _write_items(self):
+        # Уровень сжатия передаем сами: ebooklib < 0.18 игнорирует опцию compresslevel
+        level = EPUB_COMPRESSLEVEL
+        folder = self.book.FOLDER_NAME
+        for item in self.book.get_items():
+            if isinstance(item, epub.EpubNcx):
+                self.out.writestr(f"{folder}/{item.file_name}", self._get_ncx(), compresslevel=level)
+            elif isinstance(item, epub.EpubNav):
+                self.out.writestr(f"{folder}/{item.file_name}", self._get_nav(item), compresslevel=level)
+            elif item.manifest:
+                compress_type = zipfile.ZIP_STORED if item.media_type.startswith("image/") else None
+                self.out.writestr(f"{folder}/{item.file_name}", item.get_content(),
+                                  compress_type=compress_type, compresslevel=level)
+            else:
+                self.out.writestr(item.file_name, item.get_content(), compresslevel=level)
+
+
+def write_epub(filename: str, book: epub.EpubBook):
+    """Аналог epub.write_epub, но через наш EpubWriter; ошибки записи не глотаются"""
+    # Опция compresslevel (ebooklib >= 0.18) влияет только на служебные файлы;
+    # содержимое книги сжимается в EpubWriter._write_items
+    writer = EpubWriter(filename, book, {"compresslevel": EPUB_COMPRESSLEVEL})
+    writer.process()
+    writer.write()
+
+
+def build_epub_file(chapters_iter: Iterable[dict], config: Config):
+    """
+    Собирает EPUB из глав, которые приходят по одной (в порядке глав).
+    Главы не накапливаются в списке: после добавления в книгу от главы
+    остаются только ее элементы EpubHtml/EpubItem.
+    """
     book = epub.EpubBook()
+    lang = config.book_language  # свойство; читаем один раз, а не на каждую главу
 
     # Метаданные
     book.set_identifier(f"teletype-builder-{int(time.time())}")
     book.set_title(config.book_title)
-    book.set_language(config.book_language)
+    book.set_language(lang)
     book.add_author(config.book_author)
 
     # Обложка
@@ -411,22 +894,21 @@ def build_epub_file(chapters_data: list[dict], config: Config):
     toc = []
     added_images = set()
 
-    # Картинки
-    for ch_data in chapters_data:
+    for ch_data in chapters_iter:
+        # Картинки главы (одна и та же картинка может встречаться в разных главах)
         for img_filename, img_bytes in ch_data.get("images", []):
             if img_filename not in added_images:
-                ext = "png" if img_filename.endswith(".png") else "jpeg"
-                img_item = epub.EpubItem(
+                _, media_type = sniff_image_type(img_bytes)
+                img_item = epub.EpubImage(
                     uid=img_filename.replace(".", "_"),
                     file_name=f"images/{img_filename}",
-                    media_type=f"image/{ext}",
+                    media_type=media_type,
                     content=img_bytes
                 )
                 book.add_item(img_item)
                 added_images.add(img_filename)
 
-    # Главы
-    for ch_data in chapters_data:
+        # Глава
         num = ch_data["chapter_num"]
         title = ch_data.get("title") or f"Глава {num}"
         
@@ -437,7 +919,7 @@ def build_epub_file(chapters_data: list[dict], config: Config):
         ch_item = epub.EpubHtml(
             title=title,
             file_name=f"chapter_{num}.xhtml",
-            lang=config.book_language
+            lang=lang
         )
         ch_item.content = f"<h1>{title}</h1>{ch_data['html']}".encode("utf-8")
         ch_item.add_item(style)
@@ -451,7 +933,7 @@ def build_epub_file(chapters_data: list[dict], config: Config):
     book.add_item(epub.EpubNav())
     book.spine = spine
 
-    epub.write_epub(config.output_filename, book, {})
+    write_epub(config.output_filename, book)
     print(f"\n✅ EPUB создан: {config.output_filename}")
 
 
@@ -494,7 +976,7 @@ def setup_config() -> Config:
 
     # Парсим файл, чтобы узнать диапазон и редакторов
     print(f"   ...анализ {conf.links_file}...")
-    chapters_map, all_editors = parse_links_file(conf.links_file)
+    chapters_map, all_editors, editor_counts = parse_links_file(conf.links_file)
     
     if not chapters_map:
         print("   ❌ В файле не найдено ссылок teletype.in!")
@@ -509,7 +991,7 @@ def setup_config() -> Config:
     # 3. Приоритетность редакторов
     print("4. Приоритет источников (укажите номера через запятую)")
     for idx, ed in enumerate(all_editors, 1):
-        count = sum(1 for ch in chapters_map.values() if ed in ch)
+        count = editor_counts[ed]
         print(f"   {idx}. {ed} ({count} глав)")
     
     while True:
@@ -517,15 +999,17 @@ def setup_config() -> Config:
         try:
             choices = [int(x.strip()) for x in prio_str.split(",") if x.strip().isdigit()]
             selected_editors = []
+            selected_set: Set[str] = set()
             for c in choices:
                 if 1 <= c <= len(all_editors):
                     ed = all_editors[c-1]
-                    if ed not in selected_editors:
+                    if ed not in selected_set:
                         selected_editors.append(ed)
+                        selected_set.add(ed)
             
             # Добавляем оставшихся в конец автоматически
             for ed in all_editors:
-                if ed not in selected_editors:
+                if ed not in selected_set:
                     selected_editors.append(ed)
             
             conf.editor_priority = selected_editors
@@ -552,6 +1036,20 @@ def setup_config() -> Config:
     # 5. Картинки
     ans = user_input("6. Скачивать картинки? (y/n)", "y").lower()
     conf.include_images = (ans == 'y' or ans == 'yes')
+    if conf.include_images:
+        while True:
+            fmt = user_input("   Пережимать картинки? (jpeg/webp/n)", conf.image_format).lower()
+            if fmt in ("n", "no"):
+                conf.recompress_images = False
+                break
+            if fmt in ("y", "yes"):
+                fmt = conf.image_format
+            elif fmt == "jpg":
+                fmt = "jpeg"
+            if fmt in RECOMPRESS_FORMATS:
+                conf.image_format = fmt
+                break
+            print("   Некорректный ввод.")
 
     # 6. Обложка
     print()
@@ -567,6 +1065,38 @@ def setup_config() -> Config:
     return conf, chapters_map
 
 
+# ─── Скачивание ──────────────────────────────────────────────────────────────
+
+def fetch_and_cache(num: int, editor: str, url: str, conf: Config, limiter: RateLimiter) -> dict:
+    """Скачивает главу с ретраями и сразу кладет ее в кэш. Выполняется в пуле потоков."""
+    last_error: Optional[Exception] = None
+    for attempt in range(FETCH_RETRIES):
+        if attempt:
+            time.sleep(RETRY_BACKOFF * 2 ** (attempt - 1))
+        limiter.wait(editor)
+        try:
+            data = fetch_chapter(url, conf.include_images, conf.recompress_format)
+        except Exception as e:
+            print(f"   ⚠ Глава {num}: {e}")
+            last_error = e
+            continue
+        data["chapter_num"] = num
+        save_cache(data, CACHE_DIR)
+        return data
+
+    raise Exception(f"Не удалось загрузить главу {num} по ссылке {url}: {last_error}")
+
+
+def fetch_and_count(num: int, editor: str, url: str, conf: Config, limiter: RateLimiter) -> Tuple[int, int, int]:
+    """
+    fetch_and_cache для пула потоков: глава остается только в кэше, а наружу
+    отдаются (номер, длина текста, число картинок). Future держит свой результат,
+    пока жив список futures, так что полную главу с картинками в нем не храним.
+    """
+    data = fetch_and_cache(num, editor, url, conf, limiter)
+    return num, len(data["html"]), len(data["images"])
+
+
 # ─── MAIN ────────────────────────────────────────────────────────────────────
 
 def main():
@@ -578,7 +1108,7 @@ def main():
 
     # Валидация: проверяем, что для каждой выбранной главы есть хотя бы одна ссылка из приоритетных
     missing_chapters = []
-    chapters_queue = [] # [(num, url), ...]
+    chapters_queue = [] # [(num, editor, url), ...]
 
     print("\n🔍 Проверка доступности глав...")
     
@@ -588,14 +1118,14 @@ def main():
             continue
         
         # Ищем URL по приоритету
-        found_url = None
+        found = None
         for editor in conf.editor_priority:
             if editor in chapters_map[num]:
-                found_url = chapters_map[num][editor]
+                found = (num, editor, chapters_map[num][editor])
                 break
         
-        if found_url:
-            chapters_queue.append((num, found_url))
+        if found:
+            chapters_queue.append(found)
         else:
             missing_chapters.append(num)
 
@@ -613,77 +1143,71 @@ def main():
     if conf.include_images:
         os.makedirs(IMAGES_DIR, exist_ok=True)
 
-    result_data = []
-
     try:
-        # Сначала проверяем кэш
+        # Сначала проверяем кэш: один листинг папки вместо проверки каждой главы
+        cached_nums = scan_cache(CACHE_DIR)
+
         uncached_queue = []
-        for num, url in chapters_queue:
-            cached = load_cache(num, CACHE_DIR)
-            
-            # Логика повторного скачивания если нужны картинки, а их нет
-            need_reparse = False
-            if cached and conf.include_images and not cached.get("has_images") and not cached.get("images"):
-                # Для упрощения: если нет картинок в кэше, а мы их хотим - считаем, что надо перекачать.
-                # Но вдруг статья сама по себе без картинок? 
-                # (В такой простой версии кэш есть кэш. Хочешь перекачать - удали кэш)
-                pass
-
-            if cached:
+        for num, editor, url in chapters_queue:
+            if num in cached_nums:
                 print(f"📖 Глава {num} взята из кэша.")
-                result_data.append(cached)
             else:
-                uncached_queue.append((num, url))
+                uncached_queue.append((num, editor, url))
 
         # Если что-то осталось не из кэша
+        limiter = RateLimiter(DEFAULT_DELAY_MIN, DEFAULT_DELAY_MAX)
         if uncached_queue:
-            print(f"\n🌐 Запуск скачивания (Requests)...")
+            print(f"\n🌐 Запуск скачивания (Requests, потоков: {FETCH_WORKERS})...")
             
             total = len(uncached_queue)
-            for idx, (num, url) in enumerate(uncached_queue, 1):
-                print(f"[{idx}/{total}] Парсинг главы {num}...")
-                print(f"   Url: {url}")
-                
-                # Попытка парсинга с ретраями
-                retries = 3
-                success = False
-                while retries > 0:
-                    try:
-                        data = fetch_chapter(url, conf.include_images)
-                        data["chapter_num"] = num
-                        result_data.append(data)
-                        save_cache(data, CACHE_DIR)
-                        
-                        sz = len(data['html'])
-                        imgs = len(data['images'])
-                        print(f"   ✓ OK. Текст: {sz}, Изображений: {imgs}")
-                        success = True
-                        break
-                    except Exception as e:
-                        print(f"   ⚠ Ошибка: {e}")
-                        retries -= 1
-                        time.sleep(2)
-                
-                if not success:
-                    raise Exception(f"Не удалось загрузить главу {num} по ссылке {url}")
-
-                if idx < total:
-                    # Пауза меньше, так как нет тяжелого браузера, но вежливость нужна
-                    time.sleep(random.uniform(DEFAULT_DELAY_MIN, DEFAULT_DELAY_MAX))
+            executor = ThreadPoolExecutor(max_workers=FETCH_WORKERS)
+            try:
+                futures = [
+                    executor.submit(fetch_and_count, num, editor, url, conf, limiter)
+                    for num, editor, url in uncached_queue
+                ]
+                for idx, future in enumerate(as_completed(futures), 1):
+                    # Сама глава уже в кэше, здесь только статистика
+                    num, sz, imgs = future.result()
+                    print(f"[{idx}/{total}] ✓ Глава {num}. Текст: {sz}, Изображений: {imgs}")
+            finally:
+                # При ошибке не ждем оставшуюся очередь
+                executor.shutdown(wait=True, cancel_futures=True)
 
     except Exception as e:
         print(f"\n❌ Критическая ошибка: {e}")
         traceback.print_exc()
         sys.exit(1)
 
-    # Сортировка и билд
-    result_data.sort(key=lambda x: x["chapter_num"])
-    
-    if result_data:
-        print("\n📚 Генерация книги...")
-        build_epub_file(result_data, config=conf)
-    else:
+    if not chapters_queue:
         print("Нет данных для сборки.")
+        return
+
+    # Сборка: главы по порядку читаются из кэша по одной и сразу уходят в книгу
+    urls = {num: (editor, url) for num, editor, url in chapters_queue}
+
+    def iter_chapters() -> Iterator[dict]:
+        for num, data in iter_cache(sorted(urls), CACHE_DIR):
+            if data is None:
+                # Файл кэша битый — перекачиваем главу
+                editor, url = urls[num]
+                print(f"   ⚠ Кэш главы {num} не читается, скачиваем заново...")
+                data = fetch_and_cache(num, editor, url, conf, limiter)
+            yield data
+
+    # Картинки фазы скачивания уже лежат в кэше; на время сборки память им не нужна
+    IMAGE_MEMO.clear()
+
+    print("\n📚 Генерация книги...")
+    try:
+        build_epub_file(iter_chapters(), config=conf)
+    except Exception as e:
+        print(f"\n❌ Критическая ошибка: {e}")
+        traceback.print_exc()
+        sys.exit(1)
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        close_network()